@@ -4,21 +4,41 @@
 基于 Flask，复用 main.py 的 FFmpeg 逻辑
 """
 
+import asyncio
+import hashlib
 import os
+import re
+import shutil
+import sqlite3
 import subprocess
-import uuid
+import tempfile
 import threading
+import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache, partial
 from pathlib import Path
 from flask import Flask, request, jsonify, send_file, send_from_directory
 from werkzeug.utils import secure_filename
 
+from main import (
+    audio_codec_args, detect_hw_encoder, get_audio_duration, process_cover_blur,
+    video_codec_args, warn_if_x264_slow
+)
+
 app = Flask(__name__, static_folder='static')
 
 # 配置
 UPLOAD_FOLDER = Path(__file__).parent / 'uploads'
+PREBAKED_FOLDER = UPLOAD_FOLDER / '_prebaked'
 OUTPUT_FOLDER = Path(__file__).parent / 'output'
+TASKS_DB = Path(__file__).parent / 'tasks.db'
 ALLOWED_AUDIO = {'mp3', 'wav', 'm4a', 'aac', 'ogg', 'flac'}
 ALLOWED_IMAGE = {'jpg', 'jpeg', 'png', 'webp'}
+MAX_UPLOAD_SIZE = 1024 * 1024 * 1024  # 1GB
+COPY_BUFFER_SIZE = 1024 * 1024  # 上传落盘的分块大小
+
+app.config['MAX_CONTENT_LENGTH'] = MAX_UPLOAD_SIZE
 
 # 视频参数（与 main.py 一致）
 WIDTH = 1080
@@ -28,14 +48,140 @@ WAVEFORM_COLOR = "0xFFFFFF"
 WAVEFORM_HEIGHT = 150
 WAVEFORM_Y_POSITION = 1400
 
-# 任务状态存储
-tasks = {}
+# 并发控制：gunicorn 进程数 × 每进程同时处理的任务数 × 每个任务的分段并发 × 每个 ffmpeg 的线程数 ≈ CPU 核数
+# 每个 gunicorn worker 进程都有自己的 EXECUTOR，进程数取自 gunicorn 同样读取的 WEB_CONCURRENCY
+WEB_PROCESSES = max(1, int(os.environ.get('WEB_CONCURRENCY', '1')))
+TASK_WORKERS = 2
+FFMPEG_THREADS = 4
+SEGMENT_SECONDS = 300
+SEGMENT_WORKERS = max(1, (os.cpu_count() or 1) // (WEB_PROCESSES * TASK_WORKERS * FFMPEG_THREADS))
+
+# 编码中间文件优先放内存盘（macOS 可指向自建的 RAM disk）
+SCRATCH_DIR = Path(os.environ.get('SCRATCH_DIR', '/dev/shm'))
+# 预估每秒音频需要的临时空间：分段视频 + 拼接结果两份，按 ~6Mbps 计
+SCRATCH_BYTES_PER_SECOND = 2 * 6 * 1000 * 1000 // 8
+
+# 失败时保留的 ffmpeg stderr 尾部行数
+STDERR_TAIL_LINES = 50
+
+# ffmpeg -progress 输出中的已编码时长（微秒）
+OUT_TIME_RE = re.compile(rb'out_time_ms=(\d+)')
+
+# 启动时检测一次硬件编码器（h264_nvenc / h264_videotoolbox / h264_qsv / libx264）
+VIDEO_ENCODER = detect_hw_encoder()
+if VIDEO_ENCODER == 'libx264':
+    warn_if_x264_slow()
+
+# 复杂滤镜：全部由常量组成，导入时生成一次
+# 封面由 -loop 1 在输入端循环，滤镜图只负责波形
+FILTER_COMPLEX = (
+    # 音频波形生成：先转单声道并重采样到 宽度×帧率，
+    # showwaves 每帧正好取 WIDTH 个样本，输出恰好 FPS 帧，不多画被丢弃的帧
+    f"[1:a]aformat=channel_layouts=mono,aresample={WIDTH * FPS},"
+    f"showwaves=s={WIDTH}x{WAVEFORM_HEIGHT}:mode=cline:rate={FPS}:"
+    f"colors={WAVEFORM_COLOR}:scale=sqrt[wave];"
+    # 波形叠加到封面
+    f"[0:v][wave]overlay=0:{WAVEFORM_Y_POSITION}:shortest=1[v]"
+)
+
+# 编码命令的固定部分，每个任务只需填入输入/输出文件和音频参数
+COVER_INPUT_ARGS = ("-loop", "1", "-framerate", str(FPS))
+ENCODE_ARGS = (
+    "-filter_complex", FILTER_COMPLEX,
+    "-map", "[v]",
+    *video_codec_args(VIDEO_ENCODER),
+    "-threads", str(FFMPEG_THREADS),
+    "-r", str(FPS),
+    "-shortest",
+    "-fflags", "+shortest",
+    "-max_interleave_delta", "100M",
+)
+
+# 渲染参数指纹：滤镜图、编码参数或尺寸变了，旧视频就不能复用
+# 修改不在这里的渲染逻辑（如 main.process_cover_blur）时手动递增 RENDER_VERSION
+RENDER_VERSION = 1
+RENDER_SETTINGS_TAG = hashlib.sha1(
+    repr((RENDER_VERSION, WIDTH, HEIGHT, COVER_INPUT_ARGS, ENCODE_ARGS)).encode()
+).hexdigest()[:16]
 
 # 确保目录存在
 UPLOAD_FOLDER.mkdir(parents=True, exist_ok=True)
+PREBAKED_FOLDER.mkdir(parents=True, exist_ok=True)
 OUTPUT_FOLDER.mkdir(parents=True, exist_ok=True)
 
 
+class TaskStore:
+    """
+    任务状态存储（SQLite + WAL）
+    多个 gunicorn worker 进程共享同一个数据库，重启后状态也不丢失
+    """
+    
+    FIELDS = ('status', 'progress', 'output_file', 'error')
+    
+    def __init__(self, db_path: Path):
+        self._conn = sqlite3.connect(str(db_path), check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._lock = threading.Lock()
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS tasks ("
+                "id TEXT PRIMARY KEY, status TEXT NOT NULL, progress INTEGER NOT NULL, "
+                "output_file TEXT, error TEXT, render_key TEXT)"
+            )
+            # 兼容没有 render_key 列的旧数据库（旧记录不参与复用）
+            columns = {row['name'] for row in self._conn.execute("PRAGMA table_info(tasks)")}
+            if 'render_key' not in columns:
+                self._conn.execute("ALTER TABLE tasks ADD COLUMN render_key TEXT")
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_tasks_render_key ON tasks (render_key)"
+            )
+    
+    def create(self, task_id: str, render_key: str = None):
+        """新建排队中的任务"""
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT INTO tasks (id, status, progress, render_key) VALUES (?, 'queued', 0, ?)",
+                (task_id, render_key)
+            )
+    
+    def find_output(self, render_key: str):
+        """查找同一渲染输入（音频 + 封面 + 参数）最近一次成功生成的视频文件名，没有返回 None"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT output_file FROM tasks WHERE render_key = ? AND status = 'completed' "
+                "ORDER BY rowid DESC LIMIT 1",
+                (render_key,)
+            ).fetchone()
+        return row['output_file'] if row else None
+    
+    def get(self, task_id: str):
+        """获取任务状态字典，不存在返回 None"""
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT {', '.join(self.FIELDS)} FROM tasks WHERE id = ?",
+                (task_id,)
+            ).fetchone()
+        return dict(row) if row else None
+    
+    def update(self, task_id: str, **fields):
+        """更新任务的若干字段"""
+        unknown = set(fields) - set(self.FIELDS)
+        if unknown:
+            raise ValueError(f"未知的任务字段：{unknown}")
+        assignments = ', '.join(f"{name} = ?" for name in fields)
+        with self._lock, self._conn:
+            self._conn.execute(
+                f"UPDATE tasks SET {assignments} WHERE id = ?",
+                (*fields.values(), task_id)
+            )
+
+
+# 任务状态存储
+store = TaskStore(TASKS_DB)
+
+
 def allowed_audio(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_AUDIO
 
@@ -44,107 +190,290 @@ def allowed_image(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_IMAGE
 
 
-def get_audio_duration(audio_path: Path) -> float:
-    """获取音频时长（秒）"""
-    cmd = [
-        "ffprobe", "-v", "error",
-        "-show_entries", "format=duration",
-        "-of", "default=noprint_wrappers=1:nokey=1",
-        str(audio_path)
-    ]
-    result = subprocess.run(cmd, capture_output=True, text=True)
+def save_upload(file_storage, dest: Path) -> str:
+    """
+    上传文件落盘，同时计算 SHA1（用于去重），返回十六进制摘要
+    按 1MB 分块：当前块交给本次上传专用的写线程写盘，本线程同时算哈希，
+    写文件和 hashlib 都会释放 GIL，两者真正并行；并发上传互不排队
+    """
+    hasher = hashlib.sha1()
+    stream = file_storage.stream
     try:
-        return float(result.stdout.strip())
-    except:
-        return 0
+        # 退出时先关闭写线程（等待最后一次写入），再关闭文件
+        with open(dest, 'wb') as fh, ThreadPoolExecutor(max_workers=1) as writer:
+            pending = None
+            while chunk := stream.read(COPY_BUFFER_SIZE):
+                # 保证按顺序写入：上一块写完再提交下一块
+                if pending is not None:
+                    pending.result()
+                pending = writer.submit(fh.write, chunk)
+                hasher.update(chunk)
+            if pending is not None:
+                pending.result()
+    except BaseException:
+        # 客户端断开等情况下不留下写了一半的文件
+        dest.unlink(missing_ok=True)
+        raise
+    return hasher.hexdigest()
+
+
+@lru_cache(maxsize=32)
+def _file_sha1(path: str, mtime_ns: int, size: int) -> str:
+    hasher = hashlib.sha1()
+    with open(path, 'rb') as fh:
+        while chunk := fh.read(COPY_BUFFER_SIZE):
+            hasher.update(chunk)
+    return hasher.hexdigest()
 
 
-def create_video_with_waveform(cover_path: Path, audio_path: Path, output_path: Path, task_id: str) -> bool:
+def cover_sha1(cover_path: Path) -> str:
+    """封面内容的 SHA1；按路径 + 修改时间 + 大小缓存，封面不变时不重复读文件"""
+    stat = cover_path.stat()
+    return _file_sha1(str(cover_path), stat.st_mtime_ns, stat.st_size)
+
+
+def render_key(audio_hash: str, cover_path: Path) -> str:
+    """复用已生成视频的键：音频内容 + 封面内容 + 渲染参数"""
+    key = f"{audio_hash}:{cover_sha1(cover_path)}:{RENDER_SETTINGS_TAG}"
+    return hashlib.sha1(key.encode()).hexdigest()
+
+
+def get_or_build_prebaked_cover(cover_path: Path) -> Path:
     """
-    合成视频：封面 + 音频 + 动态波形
+    获取预处理好的 9:16 模糊填充封面，失败返回 None
+    按封面内容 + 尺寸缓存，同一张封面只做一次缩放+模糊
     """
-    tasks[task_id]['status'] = 'processing'
-    tasks[task_id]['progress'] = 10
-    
-    # 复杂滤镜
-    filter_complex = (
-        # 音频波形生成
-        f"[1:a]showwaves=s={WIDTH}x{WAVEFORM_HEIGHT}:mode=cline:rate={FPS}:"
-        f"colors={WAVEFORM_COLOR}:scale=sqrt[wave];"
-        # 封面处理：缩放+高斯模糊背景
-        f"[0:v]scale={WIDTH}:{HEIGHT}:force_original_aspect_ratio=increase,"
-        f"crop={WIDTH}:{HEIGHT},boxblur=20:5[bg];"
-        f"[0:v]scale={WIDTH}:{HEIGHT}:force_original_aspect_ratio=decrease[fg];"
-        f"[bg][fg]overlay=(W-w)/2:(H-h)/2[cover];"
-        # 封面循环
-        f"[cover]loop=loop=-1:size=1:start=0,setpts=N/({FPS}*TB)[looped];"
-        # 波形叠加到封面
-        f"[looped][wave]overlay=0:{WAVEFORM_Y_POSITION}:shortest=1[v]"
-    )
+    cover_hash = cover_sha1(cover_path)[:16]
+    prebaked = PREBAKED_FOLDER / f"{cover_hash}_{WIDTH}x{HEIGHT}.jpg"
+    if prebaked.exists():
+        return prebaked
     
+    # 先写临时文件再改名，避免并发任务读到写了一半的图片
+    tmp_path = PREBAKED_FOLDER / f"{cover_hash}_{uuid.uuid4().hex[:8]}.tmp.jpg"
+    if not process_cover_blur(cover_path, tmp_path):
+        tmp_path.unlink(missing_ok=True)
+        return None
+    os.replace(tmp_path, prebaked)
+    return prebaked
+
+
+def split_audio(audio_path: Path, work_dir: Path, seg_len: int = SEGMENT_SECONDS) -> list:
+    """按固定时长切分音频（流复制，不重新编码），返回分段文件列表"""
     cmd = [
         "ffmpeg", "-y",
+        "-i", str(audio_path),
+        "-map", "0:a:0",
+        "-c", "copy",
+        "-f", "segment",
+        "-segment_time", str(seg_len),
+        "-reset_timestamps", "1",
+        str(work_dir / f"seg_%03d{audio_path.suffix}")
+    ]
+    result = subprocess.run(cmd, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr)
+    return sorted(work_dir.glob(f"seg_*{audio_path.suffix}"))
+
+
+async def encode_segment(cover_path: Path, audio_path: Path, output_path: Path, on_progress,
+                         final: bool = False):
+    """
+    编码一段视频：封面 + 动态波形
+    on_progress(seconds) 回报已编码的秒数，返回 (returncode, stderr)
+    final 表示输出就是最终文件：带上音频并 faststart；
+    否则只编码视频，音频在拼接时整条混入，避免各段 AAC 接缝
+    """
+    if final:
+        output_args = ["-map", "1:a", *audio_codec_args(audio_path), "-movflags", "+faststart"]
+    else:
+        output_args = ["-an"]
+    cmd = [
+        "ffmpeg", "-y", "-nostats",
+        *COVER_INPUT_ARGS,
         "-i", str(cover_path),
         "-i", str(audio_path),
-        "-filter_complex", filter_complex,
-        "-map", "[v]",
-        "-map", "1:a",
-        "-c:v", "libx264",
-        "-preset", "fast",
-        "-crf", "23",
-        "-c:a", "aac",
-        "-b:a", "192k",
-        "-r", str(FPS),
-        "-pix_fmt", "yuv420p",
-        "-shortest",
+        *ENCODE_ARGS,
+        *output_args,
         "-progress", "pipe:1",
         str(output_path)
     ]
     
-    tasks[task_id]['progress'] = 20
+    process = await asyncio.create_subprocess_exec(
+        *cmd,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE
+    )
+    stderr_tail = deque(maxlen=STDERR_TAIL_LINES)
+    
+    async def read_progress():
+        while line := await process.stdout.readline():
+            match = OUT_TIME_RE.match(line)
+            if match:
+                on_progress(int(match.group(1)) / 1000000)
     
-    process = subprocess.Popen(
-        cmd,
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE,
-        universal_newlines=True
+    async def drain_stderr():
+        # stderr 必须同时读走，否则管道写满会把 ffmpeg 卡住
+        while line := await process.stderr.readline():
+            stderr_tail.append(line.decode(errors='replace'))
+    
+    await asyncio.gather(
+        asyncio.create_task(read_progress()),
+        asyncio.create_task(drain_stderr())
     )
+    await process.wait()
+    return process.returncode, ''.join(stderr_tail)
+
+
+def concat_videos(parts: list, audio_path: Path, output_path: Path, work_dir: Path):
+    """
+    用 concat 分离器无损拼接分段视频（只有画面），同时混入完整的原始音频，
+    输出只有一条连续的音轨；返回 (returncode, stderr)
+    """
+    list_file = work_dir / "list.txt"
+    list_file.write_text("".join(f"file '{part}'\n" for part in parts))
+    cmd = [
+        "ffmpeg", "-y",
+        "-f", "concat", "-safe", "0",
+        "-i", str(list_file),
+        "-i", str(audio_path),
+        "-map", "0:v",
+        "-map", "1:a:0",
+        "-c:v", "copy",
+        *audio_codec_args(audio_path),
+        "-shortest",
+        "-fflags", "+shortest",
+        "-max_interleave_delta", "100M",
+        "-movflags", "+faststart",
+        str(output_path)
+    ]
+    result = subprocess.run(cmd, capture_output=True, text=True)
+    return result.returncode, result.stderr
+
+
+def scratch_dir(duration: float) -> Path:
+    """
+    选择编码中间文件的目录
+    内存盘（默认 /dev/shm）空间足够时用它，分段、拼接和 faststart 的反复读写都不落盘；
+    否则回退到输出目录
+    """
+    if SCRATCH_DIR.is_dir():
+        try:
+            free = shutil.disk_usage(SCRATCH_DIR).free
+        except OSError:
+            free = 0
+        if free > duration * SCRATCH_BYTES_PER_SECOND:
+            return SCRATCH_DIR
+    return OUTPUT_FOLDER
+
+
+async def render_video(cover_path: Path, audio_path: Path, output_path: Path,
+                       duration: float, work_root: Path, task_id: str) -> list:
+    """
+    在 work_root 下的临时目录里编码，完成后移动到 output_path
+    CPU 够并行时，长音频切成 SEGMENT_SECONDS 一段并行编码画面，
+    再无损拼接并混入完整音频；返回错误信息列表
+    """
+    with tempfile.TemporaryDirectory(dir=work_root) as tmp:
+        work_dir = Path(tmp)
+        # 只有能并行编码时才切分，否则切分、拼接和接缝都是白付的代价
+        if duration > SEGMENT_SECONDS and SEGMENT_WORKERS > 1:
+            try:
+                segments = split_audio(audio_path, work_dir)
+            except RuntimeError as e:
+                return [str(e)]
+        else:
+            segments = [audio_path]
+        parts = [work_dir / f"part_{i:03d}.mp4" for i in range(len(segments))]
+        
+        # 各段已编码秒数，汇总为总进度（只在百分比变化时写库）
+        encoded = [0.0] * len(segments)
+        state = {'total': 0.0, 'progress': 20}
+        progress_scale = 70 / duration if duration > 0 else 0
+        
+        def report(index, seconds):
+            state['total'] += seconds - encoded[index]
+            encoded[index] = seconds
+            progress = 20 + int(state['total'] * progress_scale)
+            if progress > 90:
+                progress = 90
+            if progress != state['progress']:
+                state['progress'] = progress
+                store.update(task_id, progress=progress)
+        
+        # 最多 SEGMENT_WORKERS 个 ffmpeg 同时运行，事件循环只负责读管道
+        semaphore = asyncio.Semaphore(SEGMENT_WORKERS)
+        
+        async def run_segment(index):
+            async with semaphore:
+                return await encode_segment(
+                    cover_path, segments[index], parts[index], partial(report, index),
+                    final=len(segments) == 1
+                )
+        
+        results = await asyncio.gather(*(run_segment(i) for i in range(len(segments))))
+        
+        errors = [stderr for returncode, stderr in results if returncode != 0]
+        if errors:
+            return errors
+        
+        if len(parts) == 1:
+            final = parts[0]
+        else:
+            final = work_dir / "final.mp4"
+            returncode, stderr = concat_videos(parts, audio_path, final, work_dir)
+            if returncode != 0:
+                return [stderr]
+        # 同一文件系统时是改名，从内存盘出来则是一次顺序拷贝
+        shutil.move(str(final), str(output_path))
+    return []
+
+
+async def create_video_with_waveform(cover_path: Path, audio_path: Path, output_path: Path, task_id: str) -> bool:
+    """
+    合成视频：封面 + 音频 + 动态波形
+    """
+    store.update(task_id, status='processing', progress=10)
     
-    # 获取音频时长用于计算进度
+    # 封面处理：缩放+高斯模糊背景，预先生成一张 9:16 图片（按内容缓存）
+    prebaked_cover = get_or_build_prebaked_cover(cover_path)
+    if prebaked_cover is None:
+        store.update(task_id, status='failed', error='封面处理失败')
+        return False
+    
+    # 获取音频时长用于切分和计算进度
     duration = get_audio_duration(audio_path)
+    store.update(task_id, progress=20)
     
-    # 读取进度
-    for line in process.stdout:
-        if 'out_time_ms=' in line:
-            try:
-                time_ms = int(line.split('=')[1])
-                time_sec = time_ms / 1000000
-                if duration > 0:
-                    progress = min(20 + int((time_sec / duration) * 70), 90)
-                    tasks[task_id]['progress'] = progress
-            except:
-                pass
-    
-    process.wait()
-    
-    if process.returncode == 0:
-        tasks[task_id]['status'] = 'completed'
-        tasks[task_id]['progress'] = 100
-        tasks[task_id]['output_file'] = output_path.name
+    work_root = scratch_dir(duration)
+    errors = await render_video(prebaked_cover, audio_path, output_path, duration, work_root, task_id)
+    if errors and work_root != OUTPUT_FOLDER and any('No space left on device' in e for e in errors):
+        # 内存盘被并发任务写满，回退到磁盘重新编码
+        errors = await render_video(prebaked_cover, audio_path, output_path, duration, OUTPUT_FOLDER, task_id)
+    
+    if not errors:
+        store.update(task_id, status='completed', progress=100, output_file=output_path.name)
         return True
     else:
-        tasks[task_id]['status'] = 'failed'
-        tasks[task_id]['error'] = process.stderr.read()
+        store.update(task_id, status='failed', error=errors[0])
         return False
 
 
+def init_worker():
+    """每个工作线程创建一个常驻事件循环，任务间复用"""
+    asyncio.set_event_loop(asyncio.new_event_loop())
+
+
+# 后台任务线程池，限制同时编码的任务数
+EXECUTOR = ThreadPoolExecutor(max_workers=TASK_WORKERS, initializer=init_worker)
+
+
 def process_video_task(task_id: str, audio_path: Path, cover_path: Path, output_path: Path):
     """后台处理视频任务"""
     try:
-        create_video_with_waveform(cover_path, audio_path, output_path, task_id)
+        loop = asyncio.get_event_loop()
+        loop.run_until_complete(create_video_with_waveform(cover_path, audio_path, output_path, task_id))
     except Exception as e:
-        tasks[task_id]['status'] = 'failed'
-        tasks[task_id]['error'] = str(e)
+        store.update(task_id, status='failed', error=str(e))
 
 
 @app.route('/')
@@ -173,7 +502,7 @@ def upload_files():
     # 保存音频
     audio_filename = secure_filename(f"{task_id}_{audio_file.filename}")
     audio_path = UPLOAD_FOLDER / audio_filename
-    audio_file.save(str(audio_path))
+    audio_hash = save_upload(audio_file, audio_path)
     
     # 使用固定封面
     cover_path = Path(__file__).parent / 'static' / 'default_cover.png'
@@ -185,19 +514,21 @@ def upload_files():
     output_path = OUTPUT_FOLDER / output_filename
     
     # 初始化任务状态
-    tasks[task_id] = {
-        'status': 'queued',
-        'progress': 0,
-        'output_file': None,
-        'error': None
-    }
-    
-    # 启动后台处理
-    thread = threading.Thread(
-        target=process_video_task,
-        args=(task_id, audio_path, cover_path, output_path)
-    )
-    thread.start()
+    key = render_key(audio_hash, cover_path)
+    store.create(task_id, key)
+    
+    # 同样的音频、封面和参数已经生成过视频，直接复用
+    existing_output = store.find_output(key)
+    if existing_output and (OUTPUT_FOLDER / existing_output).exists():
+        audio_path.unlink(missing_ok=True)
+        store.update(task_id, status='completed', progress=100, output_file=existing_output)
+        return jsonify({
+            'task_id': task_id,
+            'message': '视频已生成'
+        })
+    
+    # 交给后台线程池处理
+    EXECUTOR.submit(process_video_task, task_id, audio_path, cover_path, output_path)
     
     return jsonify({
         'task_id': task_id,
@@ -205,22 +536,28 @@ def upload_files():
     })
 
 
+@app.errorhandler(413)
+def file_too_large(e):
+    return jsonify({'error': '文件过大，最大支持 1GB'}), 413
+
+
 @app.route('/api/status/<task_id>')
 def get_status(task_id):
     """获取任务状态"""
-    if task_id not in tasks:
+    task = store.get(task_id)
+    if task is None:
         return jsonify({'error': '任务不存在'}), 404
     
-    return jsonify(tasks[task_id])
+    return jsonify(task)
 
 
 @app.route('/api/download/<task_id>')
 def download_video(task_id):
     """下载生成的视频"""
-    if task_id not in tasks:
+    task = store.get(task_id)
+    if task is None:
         return jsonify({'error': '任务不存在'}), 404
     
-    task = tasks[task_id]
     if task['status'] != 'completed':
         return jsonify({'error': '视频尚未完成'}), 400
     
@@ -235,16 +572,24 @@ def download_video(task_id):
     )
 
 
-@app.route('/api/check-ffmpeg')
-def check_ffmpeg():
-    """检查 FFmpeg 是否可用"""
+@lru_cache(maxsize=1)
+def ffmpeg_version():
+    """获取 FFmpeg 版本，返回 (是否可用, 版本行)；进程运行期间 ffmpeg 不会变，只检查一次"""
     try:
         result = subprocess.run(['ffmpeg', '-version'], capture_output=True, text=True)
         if result.returncode == 0:
-            version = result.stdout.split('\n')[0]
-            return jsonify({'available': True, 'version': version})
-    except:
+            return True, result.stdout.split('\n')[0]
+    except FileNotFoundError:
         pass
+    return False, ''
+
+
+@app.route('/api/check-ffmpeg')
+def check_ffmpeg():
+    """检查 FFmpeg 是否可用"""
+    available, version = ffmpeg_version()
+    if available:
+        return jsonify({'available': True, 'version': version})
     return jsonify({'available': False})
 
 
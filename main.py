@@ -6,16 +6,24 @@
 """
 
 import os
+import platform
+import re
 import subprocess
 import sys
+from functools import lru_cache
+from multiprocessing import Pool
 from pathlib import Path
 
+try:
+    from mutagen import File as MutagenFile
+except ImportError:  # 未安装 mutagen 时退回 ffprobe
+    MutagenFile = None
+
 # 目录配置
 BASE_DIR = Path(__file__).parent
 INPUT_AUDIO = BASE_DIR / "input" / "audio"
 INPUT_COVER = BASE_DIR / "input" / "cover"
 OUTPUT_FINAL = BASE_DIR / "output" / "final"
-OUTPUT_TEMP = BASE_DIR / "output" / "temp"
 
 # 视频参数
 WIDTH = 1080
@@ -23,15 +31,27 @@ HEIGHT = 1920
 FPS = 30
 VIDEO_BITRATE = "5M"
 
+# 每个 ffmpeg 的线程数；批量处理时按 CPU 核数 / 线程数 并行多个文件
+FFMPEG_THREADS = 8
+
 # 波形参数
 WAVEFORM_COLOR = "0x00CED1"  # 青色波形
 WAVEFORM_HEIGHT = 150
 WAVEFORM_Y_POSITION = 1400  # 波形在视频中的Y位置（底部1/3处）
 
+# 已是 AAC 编码的音频后缀，直接复制音频流
+AAC_SUFFIXES = (".m4a", ".aac")
+
+# 硬件编码器候选（按优先级），都不可用时回退到 libx264
+HW_ENCODERS = ["h264_nvenc", "h264_videotoolbox", "h264_qsv"]
+
+# 启动时探测 ffmpeg 能力的超时（秒），驱动异常时测试编码可能卡住
+PROBE_TIMEOUT = 15
+
 
 def ensure_dirs():
     """确保所有目录存在"""
-    for d in [INPUT_AUDIO, INPUT_COVER, OUTPUT_FINAL, OUTPUT_TEMP]:
+    for d in [INPUT_AUDIO, INPUT_COVER, OUTPUT_FINAL]:
         d.mkdir(parents=True, exist_ok=True)
 
 
@@ -39,10 +59,137 @@ def check_ffmpeg():
     """检查 FFmpeg 是否安装"""
     try:
         subprocess.run(["ffmpeg", "-version"], capture_output=True, check=True)
-        return True
     except (subprocess.CalledProcessError, FileNotFoundError):
         print("❌ 错误：未找到 FFmpeg，请先安装：brew install ffmpeg")
         return False
+    
+    if detect_hw_encoder() == "libx264":
+        warn_if_x264_slow()
+    return True
+
+
+@lru_cache(maxsize=1)
+def check_x264_simd():
+    """
+    检查 libx264 是否启用了 SIMD 汇编，返回 (是否正常, cpu capabilities 字符串)
+    - 没有 ffmpeg 或没有 libx264 时返回 (None, "")，无从判断
+    - ffmpeg 以 --disable-asm 编译（部分精简 Docker 镜像）时 x264 会慢好几倍
+    """
+    try:
+        version = subprocess.run(
+            ["ffmpeg", "-hide_banner", "-version"],
+            capture_output=True, text=True, timeout=PROBE_TIMEOUT
+        )
+    except (FileNotFoundError, subprocess.TimeoutExpired):
+        return None, ""
+    if "--disable-asm" in version.stdout:
+        return False, "--disable-asm"
+    
+    # 试编码 1 秒测试画面，x264 会在日志里打印实际使用的指令集
+    try:
+        result = subprocess.run(
+            [
+                "ffmpeg", "-hide_banner",
+                "-f", "lavfi", "-i", "testsrc=d=1:s=320x240",
+                "-c:v", "libx264", "-f", "null", "-"
+            ],
+            capture_output=True, text=True, timeout=PROBE_TIMEOUT
+        )
+    except subprocess.TimeoutExpired:
+        return None, ""
+    match = re.search(r"using cpu capabilities: (.+)", result.stderr)
+    if not match:
+        return None, ""
+    capabilities = match.group(1).strip()
+    
+    machine = platform.machine().lower()
+    if machine in ("x86_64", "amd64"):
+        required = "AVX2"
+    elif machine in ("arm64", "aarch64"):
+        required = "NEON"
+    else:
+        required = None
+    ok = capabilities != "none!" and (required is None or required in capabilities.split())
+    return ok, capabilities
+
+
+def warn_if_x264_slow():
+    """x264 没有用上 SIMD 汇编时打印警告（检测不到 ffmpeg/libx264 时不提示）"""
+    ok, capabilities = check_x264_simd()
+    if ok is False:
+        print(f"⚠️  警告：libx264 未启用 SIMD 加速（{capabilities}），"
+              f"编码会慢好几倍，请安装官方或发行版的完整 FFmpeg")
+
+
+@lru_cache(maxsize=1)
+def detect_hw_encoder() -> str:
+    """
+    检测可用的 H.264 硬件编码器（结果缓存，只检测一次）
+    - 先看 ffmpeg -encoders 是否编译了该编码器
+    - 再用一帧测试编码确认硬件真的可用（编译了不代表机器上有对应显卡）
+    """
+    try:
+        result = subprocess.run(
+            ["ffmpeg", "-hide_banner", "-encoders"],
+            capture_output=True, text=True, timeout=PROBE_TIMEOUT
+        )
+    except (FileNotFoundError, subprocess.TimeoutExpired):
+        return "libx264"
+    
+    for encoder in HW_ENCODERS:
+        if f" {encoder} " not in result.stdout:
+            continue
+        try:
+            probe = subprocess.run(
+                [
+                    "ffmpeg", "-hide_banner", "-v", "error",
+                    "-f", "lavfi", "-i", "color=c=black:s=256x256:d=0.1",
+                    "-frames:v", "1", "-c:v", encoder,
+                    "-f", "null", "-"
+                ],
+                capture_output=True, timeout=PROBE_TIMEOUT
+            )
+        except subprocess.TimeoutExpired:
+            # 驱动异常卡住，按不可用处理
+            continue
+        if probe.returncode == 0:
+            return encoder
+    return "libx264"
+
+
+def video_codec_args(encoder: str) -> list:
+    """根据编码器生成视频编码参数"""
+    if encoder == "h264_nvenc":
+        return ["-c:v", encoder, "-preset", "p4", "-rc", "vbr",
+                "-b:v", VIDEO_BITRATE, "-pix_fmt", "yuv420p"]
+    if encoder == "h264_videotoolbox":
+        return ["-c:v", encoder, "-b:v", VIDEO_BITRATE, "-allow_sw", "1",
+                "-pix_fmt", "yuv420p"]
+    if encoder == "h264_qsv":
+        return ["-c:v", encoder, "-b:v", VIDEO_BITRATE, "-pix_fmt", "nv12"]
+    # 画面是静态封面 + 一条波形，帧间几乎没有变化：
+    # veryfast 省掉大量运动搜索，体积几乎不变；没有场景切换，固定 GOP
+    return ["-c:v", "libx264", "-preset", "veryfast", "-tune", "stillimage",
+            "-crf", "23", "-x264-params", "keyint=60:min-keyint=60:scenecut=0",
+            "-pix_fmt", "yuv420p"]
+
+
+def audio_codec_args(audio_path: Path) -> list:
+    """
+    音频编码参数：输入已是 AAC 时直接复制流，否则转码为 AAC 192k
+    m4a 也可能装的是 ALAC，装了 mutagen 时顺便确认一下编码
+    """
+    if audio_path.suffix.lower() in AAC_SUFFIXES:
+        codec = "mp4a"
+        if MutagenFile is not None:
+            try:
+                audio = MutagenFile(str(audio_path))
+                codec = getattr(audio.info, "codec", "mp4a") if audio else "mp4a"
+            except Exception:
+                pass
+        if codec.startswith("mp4a"):
+            return ["-c:a", "copy"]
+    return ["-c:a", "aac", "-b:a", "192k"]
 
 
 def process_cover_blur(cover_path: Path, output_path: Path) -> bool:
@@ -63,6 +210,7 @@ def process_cover_blur(cover_path: Path, output_path: Path) -> bool:
         "-i", str(cover_path),
         "-filter_complex", filter_complex,
         "-frames:v", "1",
+        "-q:v", "2",
         str(output_path)
     ]
     
@@ -75,7 +223,18 @@ def process_cover_blur(cover_path: Path, output_path: Path) -> bool:
 
 
 def get_audio_duration(audio_path: Path) -> float:
-    """获取音频时长（秒）"""
+    """
+    获取音频时长（秒），失败返回 0
+    优先用 mutagen 直接读文件头，不用为一个数字启动 ffprobe 进程
+    """
+    if MutagenFile is not None:
+        try:
+            audio = MutagenFile(str(audio_path))
+            if audio is not None and audio.info and audio.info.length:
+                return float(audio.info.length)
+        except Exception:
+            pass
+    
     cmd = [
         "ffprobe", "-v", "error",
         "-show_entries", "format=duration",
@@ -83,7 +242,10 @@ def get_audio_duration(audio_path: Path) -> float:
         str(audio_path)
     ]
     result = subprocess.run(cmd, capture_output=True, text=True)
-    return float(result.stdout.strip())
+    try:
+        return float(result.stdout.strip())
+    except ValueError:
+        return 0.0
 
 
 def create_video_with_waveform(
@@ -93,21 +255,28 @@ def create_video_with_waveform(
 ) -> bool:
     """
     合成视频：封面 + 音频 + 动态波形
+    封面模糊填充在同一条滤镜图里完成，不再经过中间 JPEG
     """
     # 复杂滤镜：
-    # 1. 循环封面图作为背景
+    # 1. 封面只解码一帧，缩放+高斯模糊背景只做一次，再用 loop 循环这一帧
     # 2. 从音频生成动态波形
     # 3. 将波形叠加到封面上
+    encoder = detect_hw_encoder()
     filter_complex = (
-        # 音频波形生成
-        f"[1:a]showwaves=s={WIDTH}x{WAVEFORM_HEIGHT}:mode=cline:rate={FPS}:"
-        f"colors={WAVEFORM_COLOR}:scale=sqrt[wave];"
+        # 封面处理：缩放+高斯模糊背景
+        f"[0:v]scale={WIDTH}:{HEIGHT}:force_original_aspect_ratio=increase,"
+        f"crop={WIDTH}:{HEIGHT},boxblur=20:5[bg];"
+        f"[0:v]scale={WIDTH}:{HEIGHT}:force_original_aspect_ratio=decrease[fg];"
+        f"[bg][fg]overlay=(W-w)/2:(H-h)/2,"
         # 封面循环
-        f"[0:v]loop=loop=-1:size=1:start=0,setpts=N/({FPS}*TB),"
-        f"scale={WIDTH}:{HEIGHT}:force_original_aspect_ratio=decrease,"
-        f"pad={WIDTH}:{HEIGHT}:(ow-iw)/2:(oh-ih)/2[bg];"
+        f"loop=loop=-1:size=1:start=0,setpts=N/({FPS}*TB)[cover];"
+        # 音频波形生成：先转单声道并重采样到 宽度×帧率，
+        # showwaves 每帧正好取 WIDTH 个样本，输出恰好 FPS 帧，不多画被丢弃的帧
+        f"[1:a]aformat=channel_layouts=mono,aresample={WIDTH * FPS},"
+        f"showwaves=s={WIDTH}x{WAVEFORM_HEIGHT}:mode=cline:rate={FPS}:"
+        f"colors={WAVEFORM_COLOR}:scale=sqrt[wave];"
         # 波形叠加到封面
-        f"[bg][wave]overlay=0:{WAVEFORM_Y_POSITION}:shortest=1[v]"
+        f"[cover][wave]overlay=0:{WAVEFORM_Y_POSITION}:shortest=1[v]"
     )
     
     cmd = [
@@ -117,18 +286,18 @@ def create_video_with_waveform(
         "-filter_complex", filter_complex,
         "-map", "[v]",
         "-map", "1:a",
-        "-c:v", "libx264",
-        "-preset", "medium",
-        "-crf", "23",
-        "-c:a", "aac",
-        "-b:a", "192k",
+        *video_codec_args(encoder),
+        "-threads", str(FFMPEG_THREADS),
+        *audio_codec_args(audio_path),
         "-r", str(FPS),
-        "-pix_fmt", "yuv420p",
         "-shortest",
+        "-fflags", "+shortest",
+        "-max_interleave_delta", "100M",
+        "-movflags", "+faststart",
         str(output_path)
     ]
     
-    print(f"🎬 正在合成视频...")
+    print(f"🎬 正在合成视频（编码器：{encoder}）...")
     result = subprocess.run(cmd, capture_output=True)
     if result.returncode != 0:
         print(f"❌ 视频合成失败")
@@ -174,16 +343,9 @@ def process_podcast(audio_file: str, cover_file: str = None):
     print(f"📁 音频：{audio_path.name}")
     print(f"🖼️  封面：{cover_path.name}")
     
-    # 处理封面（高斯模糊填充）
-    processed_cover = OUTPUT_TEMP / f"cover_9x16_{cover_path.stem}.jpg"
-    print(f"🔄 处理封面为 9:16...")
-    if not process_cover_blur(cover_path, processed_cover):
-        return False
-    print(f"✅ 封面处理完成：{processed_cover.name}")
-    
-    # 合成视频
+    # 合成视频（封面 9:16 高斯模糊填充在同一次 ffmpeg 中完成）
     output_video = OUTPUT_FINAL / f"{audio_path.stem}_video.mp4"
-    if not create_video_with_waveform(processed_cover, audio_path, output_video):
+    if not create_video_with_waveform(cover_path, audio_path, output_video):
         return False
     
     duration = get_audio_duration(audio_path)
@@ -203,14 +365,27 @@ def batch_process():
         print(f"⚠️  未找到音频文件，请在 input/audio/ 放置 mp3/wav/m4a 文件")
         return
     
-    print(f"📦 找到 {len(audio_files)} 个音频文件")
-    print("-" * 50)
+    # libx264 超过 ~8 线程后扩展性变差，多出来的核用来同时处理多个文件
+    workers = max(1, min((os.cpu_count() or 1) // FFMPEG_THREADS, len(audio_files)))
     
     success = 0
-    for audio_path in audio_files:
-        print(f"\n🎙️  处理：{audio_path.name}")
-        if process_podcast(audio_path.name):
-            success += 1
+    if workers == 1:
+        print(f"📦 找到 {len(audio_files)} 个音频文件")
+        print("-" * 50)
+        for audio_path in audio_files:
+            print(f"\n🎙️  处理：{audio_path.name}")
+            if process_podcast(audio_path.name):
+                success += 1
+            print("-" * 50)
+    else:
+        print(f"📦 找到 {len(audio_files)} 个音频文件，同时处理 {workers} 个")
+        print("-" * 50)
+        # 先在主进程检测编码器，fork 出的子进程直接继承缓存，不再各自探测
+        detect_hw_encoder()
+        # 各文件互不相关，process_podcast 只读全局配置，可以放到子进程里跑
+        with Pool(workers) as pool:
+            results = pool.map(process_podcast, [audio_path.name for audio_path in audio_files])
+        success = sum(1 for ok in results if ok)
         print("-" * 50)
     
     print(f"\n🎉 完成！成功处理 {success}/{len(audio_files)} 个文件")